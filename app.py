@@ -14,15 +14,26 @@ st.set_page_config(
 def load_data(file_path):
     """Loads the financial data from a CSV file and preprocesses it."""
     try:
-        df = pd.read_csv(file_path)
-        # Basic data type conversion
-        df['filing_period_end_date'] = pd.to_datetime(df['filing_period_end_date'])
-        df['date_filed'] = pd.to_datetime(df['date_filed'])
+        # Parse with the multi-threaded Arrow reader, converting dates while reading
+        df = pd.read_csv(
+            file_path,
+            engine='pyarrow',
+            parse_dates=['filing_period_end_date', 'date_filed']
+        )
         df['value'] = pd.to_numeric(df['value'], errors='coerce')
+        # Values drop to single precision only when every one of them survives the conversion exactly;
+        # pandas' own downcast also accepts values that are merely close
+        single_values = df['value'].astype('float32')
+        if single_values.astype('float64').equals(df['value']):
+            df['value'] = single_values
         
         # Handle potential missing or non-string table descriptions
         df['table_description'] = df['table_description'].fillna('General').astype(str)
 
+        # Low-cardinality text columns are stored as categories for cheaper filtering and grouping
+        for col in ('symbol', 'form_type', 'metric', 'table_description'):
+            df[col] = df[col].astype('category')
+
         df.dropna(subset=['value'], inplace=True)
         return df
     except FileNotFoundError:
@@ -32,50 +43,85 @@ def load_data(file_path):
         return None
 
 
+@st.cache_data
 def calculate_q4_data(df):
     """
     Calculates Q4 data for each metric using the formula: Q4 = 10-K - (Q1+Q2+Q3).
     Appends the calculated Q4 data back to the DataFrame.
     """
-    df_with_q4 = df.copy()
-    new_rows = []
+    year = df['filing_period_end_date'].dt.year
 
-    # Create a temporary year column for grouping
-    df['year'] = df['filing_period_end_date'].dt.year
-    grouped = df.groupby(['year', 'metric'])
+    # Sum and count the values of each (year, metric) pair per form type
+    grouped = df.assign(year=year).groupby(['year', 'metric', 'form_type'], observed=True)['value']
+    sums = grouped.sum().unstack('form_type').reindex(columns=['10-K', '10-Q'])
+    counts = grouped.size().unstack('form_type', fill_value=0).reindex(columns=['10-K', '10-Q'], fill_value=0)
 
-    for (year, metric), group in grouped:
-        k_reports = group[group['form_type'] == '10-K']
-        q_reports = group[group['form_type'] == '10-Q'].sort_values(by='filing_period_end_date')
+    # We need a full year's worth of data: one 10-K and three 10-Qs
+    complete = (counts['10-K'] == 1) & (counts['10-Q'] == 3)
+    q4_values = (sums['10-K'] - sums['10-Q'])[complete].rename('q4_value')
 
-        # We need a full year's worth of data: one 10-K and three 10-Qs
-        if len(k_reports) == 1 and len(q_reports) == 3:
-            k_report_value = k_reports['value'].iloc[0]
-            q_total_value = q_reports['value'].sum()
-            
-            q4_value = k_report_value - q_total_value
-            
-            k_report_row = k_reports.iloc[0].to_dict()
-            k_report_row['value'] = q4_value
-            k_report_row['form_type'] = '10-Q (Calculated)' 
-            
-            new_rows.append(k_report_row)
-
-    if new_rows:
-        q4_df = pd.DataFrame(new_rows)
-        df_with_q4 = pd.concat([df_with_q4, q4_df], ignore_index=True)
-    
-    # Clean up the temporary 'year' column
-    df_with_q4 = df_with_q4.drop(columns=['year'], errors='ignore')
-    df = df.drop(columns=['year'], errors='ignore')
-    
-    return df_with_q4.sort_values(by='filing_period_end_date').reset_index(drop=True)
+    # Without any complete year there is nothing to append; sorting already returns a new frame
+    if q4_values.empty:
+        return df.sort_values(by='filing_period_end_date', ignore_index=True)
+
+    # Carry the 10-K row metadata over to the calculated Q4 rows
+    k_reports = df[df['form_type'] == '10-K'].assign(year=year)
+    q4_df = k_reports.merge(q4_values.reset_index(), on=['year', 'metric'])
+    q4_df['value'] = q4_df.pop('q4_value')
+    q4_df['form_type'] = '10-Q (Calculated)'
+    df_with_q4 = pd.concat([df, q4_df.drop(columns=['year'])], ignore_index=True)
+    df_with_q4['form_type'] = df_with_q4['form_type'].astype('category')
+
+    return df_with_q4.sort_values(by='filing_period_end_date', ignore_index=True)
+
+
+@st.cache_data
+def filter_by_report_type(df, report_type):
+    """Returns the rows of the DataFrame matching the selected report type."""
+    if report_type == 'Quarterly':
+        quarterly_types = [t for t in df['form_type'].cat.categories if '10-Q' in t]
+        return df[df['form_type'].isin(quarterly_types)]
+    elif report_type == 'Annual':
+        return df[df['form_type'] == '10-K']
+    else: # 'All'
+        return df
+
+
+@st.cache_data
+def metrics_by_table(df):
+    """Maps each table description to the sorted list of metrics reported in it."""
+    return (
+        df.groupby('table_description', observed=True)['metric']
+        .apply(lambda metrics: sorted(metrics.unique()))
+        .to_dict()
+    )
+
+
+def aggregate_for_chart(plot_df, max_bars=5000):
+    """
+    Drops exact duplicate rows before plotting, keeping the latest filed value for each bar. Values are
+    never summed: a filing's prior-year column shares its period end date and differs only in fiscal
+    period, and repeated labels like "Other" differ only in category. Dense selections are further
+    rolled up to calendar quarters to keep the chart responsive.
+    """
+    keys = ['filing_period_end_date', 'fiscal_period', 'table_description', 'category', 'metric', 'form_type']
+    aggregations = {'value': ('value', 'last'), 'date_filed': ('date_filed', 'last')}
+    plot_df = plot_df.sort_values('date_filed', kind='stable')
+    chart_df = plot_df.groupby(keys, as_index=False, observed=True, dropna=False).agg(**aggregations)
+
+    if len(chart_df) > max_bars:
+        chart_df['filing_period_end_date'] = chart_df['filing_period_end_date'].dt.to_period('Q').dt.to_timestamp()
+        chart_df = chart_df.groupby(keys, as_index=False, observed=True, dropna=False).agg(**aggregations)
+
+    return chart_df
 
 # --- Main Application ---
 st.title("📊 Financial Report Visualizer")
 st.write("An interactive tool to visualize historical financial data from SEC filings.")
 
 DATA_FILE = 'AMD_financial_data_parallel.csv'
+TABLE_COLS = ['filing_period_end_date', 'table_description', 'metric', 'value', 'form_type', 'date_filed']
+PLOT_COLS = TABLE_COLS + ['fiscal_period', 'category']
 df_initial = load_data(DATA_FILE)
 
 if df_initial is None:
@@ -97,12 +143,7 @@ else:
     )
 
     # --- Filter data based on the selected report type ---
-    if report_type == 'Quarterly':
-        filtered_df = df[df['form_type'].str.contains('10-Q', na=False)].copy()
-    elif report_type == 'Annual':
-        filtered_df = df[df['form_type'] == '10-K'].copy()
-    else: # 'All'
-        filtered_df = df.copy()
+    filtered_df = filter_by_report_type(df, report_type)
 
     # --- Dynamic Metric Selection (Grouped by Table Description) ---
     if filtered_df.empty:
@@ -116,13 +157,19 @@ else:
         
         selected_metrics = []
         
-        # Get unique table descriptions to create separate selection groups
-        table_descriptions = sorted(filtered_df['table_description'].unique())
+        # Get unique table descriptions to create separate selection groups. They are kept in the
+        # session per report type, so metric clicks skip even hashing the frame for metrics_by_table.
+        sidebar_cache_key = f"sidebar_cache_{report_type}"
+        if sidebar_cache_key not in st.session_state:
+            table_to_metrics = metrics_by_table(filtered_df)
+            st.session_state[sidebar_cache_key] = {'tables': sorted(table_to_metrics), 'metrics': table_to_metrics}
+        table_descriptions = st.session_state[sidebar_cache_key]['tables']
+        table_to_metrics = st.session_state[sidebar_cache_key]['metrics']
 
         for table_desc in table_descriptions:
             # Use an expander for each table to keep the UI clean
             with st.sidebar.expander(f"{table_desc}", expanded=True):
-                metrics_in_table = sorted(filtered_df[filtered_df['table_description'] == table_desc]['metric'].unique())
+                metrics_in_table = table_to_metrics[table_desc]
                 
                 # Determine which of the preferred defaults apply to this table
                 defaults_for_this_table = [m for m in preferred_defaults if m in metrics_in_table]
@@ -141,12 +188,12 @@ else:
         if not selected_metrics:
             st.warning("Please select at least one metric from the sidebar to display the chart.")
         else:
-            plot_df = filtered_df[filtered_df['metric'].isin(selected_metrics)].copy()
+            plot_df = filtered_df.loc[filtered_df['metric'].isin(selected_metrics), PLOT_COLS]
             
             st.header(f"{report_type} Financial Metrics Over Time")
 
             fig = px.bar(
-                plot_df,
+                aggregate_for_chart(plot_df),
                 x='filing_period_end_date',
                 y='value',
                 color='metric',
@@ -175,4 +222,4 @@ else:
             st.plotly_chart(fig, use_container_width=True)
 
             if st.checkbox("Show Raw Data for Selection"):
-                st.dataframe(plot_df[['filing_period_end_date', 'table_description', 'metric', 'value', 'form_type', 'date_filed']])
\ No newline at end of file
+                st.dataframe(plot_df[TABLE_COLS])
\ No newline at end of file
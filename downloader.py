@@ -1,10 +1,19 @@
 # downloader.py
 import asyncio
 import aiohttp
+import aiofiles
+import contextlib
 import os
 import logging
 
-async def fetch_and_save(session, filing_meta, save_dir):
+# The one download limit: the semaphore in download_all_filings keeps this many requests in flight,
+# and the connection pool is sized to match so every request holds a reusable connection
+MAX_CONCURRENT_DOWNLOADS = 8
+KEEPALIVE_TIMEOUT = 30
+REQUEST_TIMEOUT = 30
+CHUNK_SIZE = 64 * 1024
+
+async def fetch_and_save(session, filing_meta, save_dir, semaphore, existing_files):
     """Coroutine to fetch one URL and save its content to a file."""
     url = filing_meta.get('url')
     if not url:
@@ -21,32 +30,58 @@ async def fetch_and_save(session, filing_meta, save_dir):
     
     filing_meta['local_filepath'] = filepath # Add filepath to meta for later use
 
-    if os.path.exists(filepath):
+    if safe_filename in existing_files:
         logging.info(f"File already exists, skipping download: {safe_filename}")
         return filepath, filing_meta
 
+    # Stream the raw bytes to a partial file so an interrupted download is never mistaken for a complete one
+    partial_filepath = filepath + '.part'
     try:
-        async with session.get(url, timeout=30) as response:
+        async with semaphore, session.get(url) as response:
             response.raise_for_status()
-            content = await response.text()
-            with open(filepath, 'w', encoding='utf-8') as f:
-                f.write(content)
+            async with aiofiles.open(partial_filepath, 'wb') as f:
+                async for chunk in response.content.iter_chunked(CHUNK_SIZE):
+                    await f.write(chunk)
+            os.replace(partial_filepath, filepath)
+            existing_files.add(safe_filename)
             logging.info(f"Successfully downloaded: {safe_filename}")
             return filepath, filing_meta
     except Exception as e:
         logging.error(f"Failed to download or save {url}: {e}")
         return None, None
+    finally:
+        # Left behind only when the download failed or was cancelled before the rename
+        with contextlib.suppress(FileNotFoundError):
+            os.remove(partial_filepath)
+
+def create_session():
+    """Creates the pooled HTTP session used for downloading filings."""
+    headers = {'User-Agent': 'Mozilla/5.0'}
+    connector = aiohttp.TCPConnector(
+        limit=MAX_CONCURRENT_DOWNLOADS,
+        keepalive_timeout=KEEPALIVE_TIMEOUT
+    )
+    timeout = aiohttp.ClientTimeout(total=REQUEST_TIMEOUT)
+    return aiohttp.ClientSession(headers=headers, connector=connector, timeout=timeout)
 
 async def download_all_filings(filings_meta, save_dir):
-    """Manages the concurrent download of all filings."""
+    """
+    Manages the concurrent download of all filings over one pooled session.
+    """
     if not os.path.exists(save_dir):
         os.makedirs(save_dir)
         logging.info(f"Created save directory: {save_dir}")
-        
-    headers = {'User-Agent': 'Mozilla/5.0'}
-    async with aiohttp.ClientSession(headers=headers) as session:
-        tasks = [fetch_and_save(session, meta, save_dir) for meta in filings_meta]
-        results = await asyncio.gather(*tasks)
+
+    # Snapshot the directory once instead of checking every filing's path separately
+    with os.scandir(save_dir) as entries:
+        existing_files = {entry.name for entry in entries if entry.is_file()}
+
+    # Queue requests here rather than in the pool, where waiting would count against the timeout
+    semaphore = asyncio.Semaphore(MAX_CONCURRENT_DOWNLOADS)
+
+    async with create_session() as session, asyncio.TaskGroup() as tg:
+        tasks = [tg.create_task(fetch_and_save(session, meta, save_dir, semaphore, existing_files)) for meta in filings_meta]
+    results = [task.result() for task in tasks]
     
     successful_downloads = [res for res in results if res[0] is not None]
     logging.info(f"Successfully downloaded/verified {len(successful_downloads)} of {len(filings_meta)} total filings.")
@@ -1,16 +1,21 @@
 # llm_analyzer.py
+import functools
+import hashlib
 import logging
 import json
 import os
 import re
+import diskcache
 import google.generativeai as genai
+from google.api_core import exceptions as google_exceptions
 
 # --- Token Counter ---
 class TokenCounter:
-    """A simple class to count input and output tokens for API calls."""
+    """A simple class to count input and output tokens for API calls, and the calls that failed."""
     def __init__(self):
         self.input_tokens = 0
         self.output_tokens = 0
+        self.failed_calls = 0
 
     def add_input(self, token_count):
         self.input_tokens += token_count
@@ -18,6 +23,9 @@ class TokenCounter:
     def add_output(self, token_count):
         self.output_tokens += token_count
 
+    def add_failure(self):
+        self.failed_calls += 1
+
     @property
     def total_tokens(self):
         return self.input_tokens + self.output_tokens
@@ -34,8 +42,8 @@ GEMINI_CONFIGURED = False
 try:
     api_key = os.getenv("GEMINI_API_KEY")
     if api_key:
+        # The key is validated by the first real request instead of an extra round trip at import time
         genai.configure(api_key=api_key)
-        genai.list_models()
         GEMINI_CONFIGURED = True
         logging.info("Gemini API configured successfully.")
     else:
@@ -43,121 +51,144 @@ try:
 except Exception as e:
     logging.warning(f"Could not configure Gemini API. LLM features will be disabled. Error: {e}")
 
-def validate_financial_toc(toc_descriptions, statement_types, token_counter):
+# --- Keyword Pre-Classification ---
+# Short headings that start with a statement title are classified locally without an LLM call.
+# Patterns are anchored so MD&A headings like "Supplemental cash flow information" still go to the LLM.
+_STATEMENT_TITLE_PREFIX = r'^\s*(?:(?:unaudited|condensed|consolidated|combined|interim)\s+)*'
+FAST_MATCH = {
+    'BALANCE_SHEET_STATEMENT': re.compile(_STATEMENT_TITLE_PREFIX + r'balance\s+sheets?\b', re.IGNORECASE),
+    'CASH_FLOW_STATEMENT': re.compile(_STATEMENT_TITLE_PREFIX + r'statements?\s+of\s+cash\s*flows?\b', re.IGNORECASE),
+    'INCOME_STATEMENT': re.compile(_STATEMENT_TITLE_PREFIX + r'statements?\s+of\s+(?:operations|income|earnings)\b', re.IGNORECASE),
+}
+FAST_MATCH_EXCLUDE = re.compile(r'off[\s-]*balance', re.IGNORECASE)
+FAST_MATCH_MAX_LENGTH = 300
+
+# Outermost JSON object in a model response, which may be wrapped in prose or code fences
+JSON_OBJECT_PATTERN = re.compile(r'\{.*\}', re.DOTALL)
+
+def match_statement_by_keyword(text_snippet, statement_types):
     """
-    Uses an LLM to validate if a list of ToC descriptions likely contains all required financial statements.
+    Returns the statement type whose keyword pattern uniquely matches a short snippet, or None when ambiguous.
     """
-    if not GEMINI_CONFIGURED:
-        logging.warning("Gemini not configured, cannot validate ToC.")
-        return False
-
-    prompt = f"""
-You are an expert financial analyst. Your task is to determine if a given Table of Contents (ToC) is a specific "Index to Financial Statements".
-
-A ToC is considered a valid "Index to Financial Statements" ONLY IF it contains clear references to ALL THREE of the following statement types:
-{json.dumps(statement_types, indent=2)}
-
-Analyze the list of "Available ToC Descriptions" below. Based on your analysis, decide if it meets the condition.
-
-Available ToC Descriptions:
-{json.dumps(toc_descriptions, indent=2)}
+    if len(text_snippet) > FAST_MATCH_MAX_LENGTH or FAST_MATCH_EXCLUDE.search(text_snippet):
+        return None
+    matches = [s_type for s_type in statement_types if s_type in FAST_MATCH and FAST_MATCH[s_type].search(text_snippet)]
+    return matches[0] if len(matches) == 1 else None
 
-Respond with a single JSON object ONLY, in the format: {{"is_complete_financial_toc": boolean}}
-- Set `is_complete_financial_toc` to `true` if you are confident that entries for all three required statement types are present.
-- Set `is_complete_financial_toc` to `false` otherwise.
-"""
-    try:
-        model = genai.GenerativeModel('gemini-1.5-flash')
-        
-        # Count input tokens
-        input_token_count = model.count_tokens(prompt).total_tokens
-        token_counter.add_input(input_token_count)
-        
-        response = model.generate_content(prompt)
+# Most text snippets classified in one prompt, keeping prompts and responses short
+LLM_SNIPPET_BATCH_SIZE = 20
 
-        # Count output tokens
-        output_token_count = model.count_tokens(response.text).total_tokens
-        token_counter.add_output(output_token_count)
+LLM_MODEL_NAME = 'gemini-1.5-flash'
 
-        json_match = re.search(r'\{.*\}', response.text, re.DOTALL)
-        if not json_match:
-            logging.error(f"LLM validator did not return a valid JSON object. Response: {response.text}")
-            return False
+# Responses are cached on disk by model and prompt hash, as ToC entries and statement headings repeat
+# across filings. Set LLM_CACHE_ENABLED to False to always query the model.
+LLM_CACHE_ENABLED = True
+LLM_CACHE_DIR = '.llm_cache'
+_RESPONSE_CACHE = diskcache.Cache(LLM_CACHE_DIR)
 
-        result = json.loads(json_match.group(0))
-        is_complete = result.get("is_complete_financial_toc", False)
+@functools.lru_cache(maxsize=1)
+def _get_model():
+    """Builds the model on first use; the instance is shared by every classification call in this process."""
+    return genai.GenerativeModel(LLM_MODEL_NAME)
 
-        if is_complete:
-            logging.info("LLM validated this ToC as a complete financial index.")
-        else:
-            logging.info("LLM did not validate this ToC as a complete financial index.")
+def is_api_key_error(error):
+    """Returns whether an API error means the configured key will never be accepted."""
+    if isinstance(error, (google_exceptions.PermissionDenied, google_exceptions.Unauthenticated)):
+        return True
+    # An invalid key is reported as a bad request, which is otherwise specific to the prompt
+    return isinstance(error, google_exceptions.InvalidArgument) and 'api key' in str(error).lower()
 
-        return is_complete
+def generate_content(prompt, token_counter):
+    """
+    Sends a prompt to the shared model and returns the response text, recording its token usage.
+    Previously seen prompts are answered from the disk cache without an API call or token cost.
+    LLM features are disabled if a request is rejected for its API key, as the key is not checked up front.
+    """
+    global GEMINI_CONFIGURED
+    # Keyed on the model too, so answers from a previous model are not reused after switching
+    cache_key = hashlib.sha256(f"{LLM_MODEL_NAME}\n{prompt}".encode('utf-8')).hexdigest()
+    if LLM_CACHE_ENABLED:
+        cached_text = _RESPONSE_CACHE.get(cache_key)
+        if cached_text is not None:
+            return cached_text
 
+    try:
+        response = _get_model().generate_content(prompt)
     except Exception as e:
-        logging.error(f"Error during LLM ToC validation: {e}")
-        return False
+        token_counter.add_failure()
+        # Rate limits, timeouts and network errors only fail this request
+        if is_api_key_error(e):
+            GEMINI_CONFIGURED = False
+            logging.warning(f"Gemini API rejected the API key. LLM features will be disabled. Error: {e}")
+        raise
+    usage = response.usage_metadata
+    token_counter.add_input(usage.prompt_token_count)
+    token_counter.add_output(usage.candidates_token_count)
+    if LLM_CACHE_ENABLED:
+        _RESPONSE_CACHE.set(cache_key, response.text)
+    return response.text
 
 def classify_toc_items(toc_items, statement_types, token_counter):
     """
-    Uses an LLM to classify ToC item descriptions into financial statement types.
+    Uses an LLM to validate that a ToC indexes all required financial statements and, in the
+    same call, classify its item descriptions into financial statement types.
+    Returns an empty mapping when the ToC is not a complete financial index.
     """
     if not GEMINI_CONFIGURED:
         logging.warning("Gemini not configured, cannot classify ToC items.")
         return {}
 
-    toc_descriptions = [item.get('item_description') for item in toc_items if item.get('item_description')]
+    # Items are numbered so the LLM can answer with short indices instead of copying descriptions back
+    toc_descriptions = {str(i): item.item_description for i, item in enumerate(toc_items) if item.item_description}
 
     prompt = f"""
 You are a helpful assistant designed to return structured JSON data.
-Your task is to analyze a list of item descriptions from a financial filing's Table of Contents and map them to a predefined list of financial statement types.
+Your task is to analyze a list of item descriptions from a financial filing's Table of Contents, decide whether it is a specific "Index to Financial Statements", and map its items to a predefined list of financial statement types.
 
 1.  **Required Statement Types**: You must find a match for each of these types:
     {json.dumps(statement_types, indent=2)}
 
-2.  **Available Descriptions**: Here are the descriptions from the Table of Contents:
+2.  **Available Descriptions**: Here are the numbered descriptions from the Table of Contents:
     {json.dumps(toc_descriptions, indent=2)}
 
 3.  **Task**:
+    - Decide if the Table of Contents is a valid "Index to Financial Statements". It is valid ONLY IF it contains clear references to ALL THREE of the required statement types.
     - Review the "Available Descriptions" and find the best match for each of the "Required Statement Types".
-    - The match must be the **EXACT** string from the "Available Descriptions" list.
-    - If you cannot find a confident match for a specific statement type, omit it from your response.
+    - Each match must be given as the **NUMBER** of the matching entry in the "Available Descriptions" list.
+    - If you cannot find a confident match for a specific statement type, omit it from the mapping.
 
 4.  **Output Format**: Your entire response must be a single JSON object, with no other text before or after it.
+    - Set `is_complete_financial_toc` to `true` if you are confident that entries for all three required statement types are present, `false` otherwise.
 
     **Example Output:**
     {{
-      "INCOME_STATEMENT": "Condensed Consolidated Statements of Operations",
-      "BALANCE_SHEET_STATEMENT": "Condensed Consolidated Balance Sheets",
-      "CASH_FLOW_STATEMENT": "Condensed Consolidated Statements of Cash Flows"
+      "is_complete_financial_toc": true,
+      "mapping": {{
+        "INCOME_STATEMENT": 4,
+        "BALANCE_SHEET_STATEMENT": 3,
+        "CASH_FLOW_STATEMENT": 6
+      }}
     }}
 """
     try:
-        model = genai.GenerativeModel('gemini-1.5-flash')
-        
-        # Count input tokens
-        input_token_count = model.count_tokens(prompt).total_tokens
-        token_counter.add_input(input_token_count)
-
-        response = model.generate_content(prompt)
+        response_text = generate_content(prompt, token_counter)
         
-        # Count output tokens
-        output_token_count = model.count_tokens(response.text).total_tokens
-        token_counter.add_output(output_token_count)
-        
-        json_match = re.search(r'\{.*\}', response.text, re.DOTALL)
+        json_match = JSON_OBJECT_PATTERN.search(response_text)
         if not json_match:
-            logging.error(f"LLM did not return a valid JSON object. Response: {response.text}")
+            logging.error(f"LLM did not return a valid JSON object. Response: {response_text}")
             return {}
         
-        mapped_descriptions = json.loads(json_match.group(0))
+        result = json.loads(json_match.group(0))
+        if not result.get("is_complete_financial_toc", False):
+            logging.info("LLM did not validate this ToC as a complete financial index.")
+            return {}
 
+        mapped_indices = result.get("mapping", {})
         final_mapping = {}
-        desc_to_item_map = {item['item_description']: item for item in toc_items}
 
-        for statement_type, description in mapped_descriptions.items():
-            if statement_type in statement_types and description in desc_to_item_map:
-                final_mapping[statement_type] = desc_to_item_map[description]
+        for statement_type, index in mapped_indices.items():
+            if statement_type in statement_types and str(index) in toc_descriptions:
+                final_mapping[statement_type] = toc_items[int(index)]
         
         if final_mapping:
             logging.info(f"LLM successfully mapped {len(final_mapping)} ToC items to financial statements.")
@@ -170,58 +201,77 @@ Your task is to analyze a list of item descriptions from a financial filing's Ta
         logging.error(f"Error during LLM ToC classification: {e}")
         return {}
 
-def classify_table_by_surrounding_text(text_snippet, statement_types, token_counter):
+def classify_text_snippets(text_snippets, statement_types, token_counter):
     """
-    Uses an LLM to classify a text snippet (e.g., a table header) into a financial statement type.
+    Uses a single LLM call to classify a batch of text snippets (e.g., table headers) into financial statement types.
+    Returns a list aligned with `text_snippets` holding the identified type or None for each snippet.
     """
+    results = [None] * len(text_snippets)
+
+    # Long passages and notes are never statement headings, and obvious headings are matched locally
+    candidates = {}
+    # Repeated headings (e.g. a statement continued over several tables) are sent once, keyed by
+    # their first index, and the answer is copied to the later occurrences
+    first_index_by_snippet = {}
+    repeat_indices = {}
+    for i, snippet in enumerate(text_snippets):
+        if len(snippet) > 1000 or snippet.lower().startswith("note"):
+            continue
+        keyword_type = match_statement_by_keyword(snippet, statement_types)
+        if keyword_type:
+            logging.info(f"Keyword match classified text snippet as: {keyword_type}")
+            results[i] = keyword_type
+        else:
+            first_index = first_index_by_snippet.setdefault(snippet, i)
+            if first_index == i:
+                candidates[str(i)] = snippet
+            else:
+                repeat_indices.setdefault(first_index, []).append(i)
+    if not candidates:
+        return results
     if not GEMINI_CONFIGURED:
         logging.warning("Gemini not configured, cannot classify table by text.")
-        return None
-
-    if len(text_snippet) > 1000 or text_snippet.lower().startswith("note"):
-        return None
+        return results
 
     prompt = f"""
-You are an expert financial analyst. Your task is to identify which financial statement a given text heading refers to.
+You are an expert financial analyst. Your task is to identify which financial statement each of the given text headings refers to.
 
 The possible financial statement types are:
 {json.dumps(statement_types, indent=2)}
 
-Analyze the "Text Heading" below. Based on your analysis, determine which statement type it represents.
+Analyze each of the numbered "Text Headings" below. Based on your analysis, determine which statement type each one represents.
 
-Text Heading:
-"{text_snippet}"
+Text Headings:
+{json.dumps(candidates, indent=2)}
 
-Respond with a single JSON object ONLY, in the format: {{"identified_statement_type": "YOUR_CONCLUSION"}}
-- The value for "identified_statement_type" must be one of the provided statement types or "None" if it does not match any.
+Respond with a single JSON object ONLY, mapping every heading number to your conclusion, in the format: {{"0": "YOUR_CONCLUSION", "1": "YOUR_CONCLUSION"}}
+- Each value must be one of the provided statement types or "None" if the heading does not match any.
 """
     try:
-        model = genai.GenerativeModel('gemini-1.5-flash')
+        response_text = generate_content(prompt, token_counter)
 
-        # Count input tokens
-        input_token_count = model.count_tokens(prompt).total_tokens
-        token_counter.add_input(input_token_count)
-        
-        response = model.generate_content(prompt)
-        
-        # Count output tokens
-        output_token_count = model.count_tokens(response.text).total_tokens
-        token_counter.add_output(output_token_count)
-
-        json_match = re.search(r'\{.*\}', response.text, re.DOTALL)
+        json_match = JSON_OBJECT_PATTERN.search(response_text)
         if not json_match:
-            logging.error(f"LLM text classifier did not return a valid JSON object. Response: {response.text}")
-            return None
+            logging.error(f"LLM text classifier did not return a valid JSON object. Response: {response_text}")
+            return results
             
-        result = json.loads(json_match.group(0))
-        identified_type = result.get("identified_statement_type")
+        identified_types = json.loads(json_match.group(0))
 
-        if identified_type in statement_types:
-            logging.info(f"LLM classified text snippet as: {identified_type}")
-            return identified_type
-        else:
-            return None
+        for key, identified_type in identified_types.items():
+            if key in candidates and identified_type in statement_types:
+                logging.info(f"LLM classified text snippet as: {identified_type}")
+                results[int(key)] = identified_type
+                for repeat_index in repeat_indices.get(int(key), ()):
+                    results[repeat_index] = identified_type
+
+        return results
 
     except Exception as e:
         logging.error(f"Error during LLM table text classification: {e}")
-        return None
\ No newline at end of file
+        return results
+
+def classify_table_by_surrounding_text(text_snippet, statement_types, token_counter):
+    """
+    Uses an LLM to classify a text snippet (e.g., a table header) into a financial statement type.
+    """
+    return classify_text_snippets([text_snippet], statement_types, token_counter)[0]
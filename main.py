@@ -1,17 +1,36 @@
 # main.py
 import logging
 import logging.handlers
+import numpy as np
 import pandas as pd
 import asyncio
+import contextlib
 import json
-from concurrent.futures import ProcessPoolExecutor
-from functools import partial
 import multiprocessing
+from concurrent.futures import ThreadPoolExecutor
+from multiprocessing import shared_memory
 import os
+import pickle
+import sys
+
+try:
+    import pyarrow as pa
+    from pyarrow import csv as pacsv
+except ImportError:
+    pa = None
 
 from sec_api import fetch_filing_metadata
 from downloader import download_all_filings
-from parser import process_single_filing
+from parser import DATA_POINT_FIELDS, init_worker, load_terms, process_filing_task
+
+# Process filings on threads instead of worker processes. Tree building in BeautifulSoup runs
+# Python code under the GIL even with the lxml parser, so processes remain the faster default.
+USE_THREADS = False
+
+# Start method main() sets for the worker processes, or None to keep the platform default. Fork lets the
+# workers inherit the parsed terms instead of loading them again, but is only safe to force on Linux: macOS
+# lists fork yet defaults to spawn. 'forkserver' imports the parsing stack once and forks workers from it.
+WORKER_START_METHOD = 'fork' if sys.platform.startswith('linux') else None
 
 def listener_configurer():
     """Configures logging for the listener process."""
@@ -31,7 +50,12 @@ def listener_process(queue, configurer):
             record = queue.get()
             if record is None:
                 break
-            logger.handle(record)
+            # Workers send their records in batches
+            if isinstance(record, list):
+                for batched_record in record:
+                    logger.handle(batched_record)
+            else:
+                logger.handle(record)
         except Exception:
             import sys, traceback
             print('Whoops! Problem:', file=sys.stderr)
@@ -48,46 +72,38 @@ def report_token_usage_and_cost(filing_reports):
     }
     TOKEN_THRESHOLD = 128000
 
-    total_input = 0
-    total_output = 0
-    total_cost = 0.0
+    filepaths = [report.get('filepath', 'Unknown File') for report in filing_reports]
+    input_tokens = np.fromiter((report.get('tokens', {}).get('input', 0) for report in filing_reports), dtype=np.int64, count=len(filing_reports))
+    output_tokens = np.fromiter((report.get('tokens', {}).get('output', 0) for report in filing_reports), dtype=np.int64, count=len(filing_reports))
+    total_tokens = input_tokens + output_tokens
 
-    logger.info("\n" + "="*80)
-    logger.info("--- API Usage and Cost Estimation Summary ---")
-    
-    # Header for the summary table
-    logger.info(f"{'Filename':<50} | {'Input Tokens':>15} | {'Output Tokens':>15} | {'Total Tokens':>15} | {'Est. Cost (USD)':>18}")
-    logger.info("-" * 120)
-
-    for report in filing_reports:
-        filepath = report.get('filepath', 'Unknown File')
-        token_counts = report.get('tokens', {'input': 0, 'output': 0})
-        
-        input_tokens = token_counts.get('input', 0)
-        output_tokens = token_counts.get('output', 0)
-        total_tokens = input_tokens + output_tokens
-
-        # Determine pricing tier and calculate cost
-        if input_tokens > TOKEN_THRESHOLD:
-            logger.warning(f"Note: Input for {filepath} exceeded 128k tokens, using higher pricing tier.")
-            input_cost = (input_tokens / 1_000_000) * PRICING['large_context']['input']
-            output_cost = (output_tokens / 1_000_000) * PRICING['large_context']['output']
-        else:
-            input_cost = (input_tokens / 1_000_000) * PRICING['standard']['input']
-            output_cost = (output_tokens / 1_000_000) * PRICING['standard']['output']
-        
-        file_cost = input_cost + output_cost
+    # Determine the pricing tier per filing and calculate costs for all filings at once
+    large_context = input_tokens > TOKEN_THRESHOLD
+    input_rate = np.where(large_context, PRICING['large_context']['input'], PRICING['standard']['input'])
+    output_rate = np.where(large_context, PRICING['large_context']['output'], PRICING['standard']['output'])
+    file_costs = (input_tokens / 1_000_000) * input_rate + (output_tokens / 1_000_000) * output_rate
 
-        total_input += input_tokens
-        total_output += output_tokens
-        total_cost += file_cost
-        
-        logger.info(f"{filepath:<50} | {input_tokens:>15,} | {output_tokens:>15,} | {total_tokens:>15,} | ${file_cost:>17.6f}")
+    for i in np.flatnonzero(large_context):
+        logger.warning(f"Note: Input for {filepaths[i]} exceeded 128k tokens, using higher pricing tier.")
 
-    logger.info("-" * 120)
+    total_input = int(input_tokens.sum())
+    total_output = int(output_tokens.sum())
+    total_cost = float(file_costs.sum())
     grand_total_tokens = total_input + total_output
-    logger.info(f"{'TOTALS':<50} | {total_input:>15,} | {total_output:>15,} | {grand_total_tokens:>15,} | ${total_cost:>17.6f}")
-    logger.info("="*80)
+
+    # The whole table is logged as one record
+    table_lines = [
+        "\n" + "="*80,
+        "--- API Usage and Cost Estimation Summary ---",
+        f"{'Filename':<50} | {'Input Tokens':>15} | {'Output Tokens':>15} | {'Total Tokens':>15} | {'Est. Cost (USD)':>18}",
+        "-" * 120,
+    ]
+    for filepath, file_input, file_output, file_total, file_cost in zip(filepaths, input_tokens.tolist(), output_tokens.tolist(), total_tokens.tolist(), file_costs.tolist()):
+        table_lines.append(f"{filepath:<50} | {file_input:>15,} | {file_output:>15,} | {file_total:>15,} | ${file_cost:>17.6f}")
+    table_lines.append("-" * 120)
+    table_lines.append(f"{'TOTALS':<50} | {total_input:>15,} | {total_output:>15,} | {grand_total_tokens:>15,} | ${total_cost:>17.6f}")
+    table_lines.append("="*80)
+    logger.info("\n".join(table_lines))
 
 
 def scrape_sec_filings(symbol, start_year, end_year, form_groups, filing_urls, save_dir, log_queue):
@@ -108,6 +124,14 @@ def scrape_sec_filings(symbol, start_year, end_year, form_groups, filing_urls, s
     if not filings_meta_to_process:
         return None
 
+    # The same filing can be listed under several form groups; keep the first entry per URL
+    unique_filings = {}
+    for filing_meta in filings_meta_to_process:
+        unique_filings.setdefault(filing_meta.get('url'), filing_meta)
+    if len(unique_filings) < len(filings_meta_to_process):
+        logger.info(f"Removed {len(filings_meta_to_process) - len(unique_filings)} duplicate filings.")
+    filings_meta_to_process = list(unique_filings.values())
+
     logger.info(f"\n--- STAGE 1: Starting Asynchronous Download of {len(filings_meta_to_process)} filings ---")
     downloaded_files_info = asyncio.run(download_all_filings(filings_meta_to_process, save_dir))
     
@@ -119,52 +143,85 @@ def scrape_sec_filings(symbol, start_year, end_year, form_groups, filing_urls, s
     with open('financial_statement_terms.json', 'r', encoding='utf-8') as f:
         financial_statement_terms = json.load(f)
     
-    worker_func = partial(process_single_filing, terms_dict=financial_statement_terms, queue=log_queue)
+    terms_shm = None
+    if USE_THREADS or multiprocessing.get_start_method() == 'fork':
+        # Threads share, and forked workers inherit, the terms from this process's memory
+        load_terms(financial_statement_terms)
+        worker_initargs = (log_queue,)
+    else:
+        if multiprocessing.get_start_method() == 'forkserver':
+            # The fork server imports the parsing stack once and forks each worker from that state
+            multiprocessing.set_forkserver_preload(['parser', 'llm_analyzer', 'bs4', 'lxml.etree', 'numpy'])
+        # Pickle the terms once into shared memory; each worker loads them a single time on startup
+        terms_payload = pickle.dumps(financial_statement_terms, protocol=5)
+        terms_shm = shared_memory.SharedMemory(create=True, size=len(terms_payload))
+        terms_shm.buf[:len(terms_payload)] = terms_payload
+        worker_initargs = (log_queue, terms_shm.name, len(terms_payload))
 
-    all_data_points = []
+    # Each worker returns its data points column-wise; they are appended to plain lists, so strings stay
+    # Python objects rather than fixed-width arrays sized to the longest value
+    data_columns = {field: [] for field in DATA_POINT_FIELDS}
     filing_reports = []
 
-    with ProcessPoolExecutor(max_workers=None) as executor:
-        results = list(executor.map(worker_func, downloaded_files_info))
+    # No more workers than filings, and about four chunks per worker to cut per-task IPC
+    num_workers = min(os.cpu_count() or 1, len(downloaded_files_info))
+    chunksize = max(1, len(downloaded_files_info) // (4 * num_workers))
 
-    for result_data, report, token_counts in results:
-        if result_data: all_data_points.extend(result_data)
-        # Attach token counts to the report for the summary
-        report['tokens'] = token_counts
-        filing_reports.append(report)
+    # Results are aggregated as each filing finishes rather than after the whole batch
+    try:
+        with contextlib.ExitStack() as stack:
+            if USE_THREADS:
+                executor = stack.enter_context(ThreadPoolExecutor(max_workers=num_workers))
+                results = executor.map(process_filing_task, downloaded_files_info)
+            else:
+                pool = stack.enter_context(multiprocessing.Pool(processes=num_workers, initializer=init_worker, initargs=worker_initargs))
+                results = pool.imap_unordered(process_filing_task, downloaded_files_info, chunksize=chunksize)
+            for result_data, report, token_counts in results:
+                if result_data['value']:
+                    for field, values in result_data.items(): data_columns[field].extend(values)
+                # Attach token counts to the report for the summary
+                report['tokens'] = token_counts
+                filing_reports.append(report)
+    finally:
+        if terms_shm is not None:
+            terms_shm.close()
+            terms_shm.unlink()
     
     logger.info("\n" + "="*70)
     logger.info("Scraping and Processing Complete.")
     
-    logger.info("--- Detailed Filing Summary ---")
+    # One pass builds the per-filing summary and counts fully scraped filings
+    summary_lines = ["--- Detailed Filing Summary ---"]
+    successful_filings = 0
     for report in filing_reports:
         filepath = report.get('filepath', 'Unknown File')
         statements = report.get('statements', {})
         found = [s_type for s_type, status in statements.items() if status != 'Missing' and 'Failed' not in status]
         missing = [s_type for s_type, status in statements.items() if status == 'Missing']
         failed = [s_type for s_type, status in statements.items() if 'Failed' in status]
+        if not missing and not failed:
+            successful_filings += 1
 
         summary_message = f"File: {filepath} | Found {len(found)}/3 statements."
         if missing: summary_message += f" (Missing: {', '.join(missing)})"
         if failed: summary_message += f" (Failed on: {', '.join(failed)})"
-        
-        logger.info(summary_message)
-    logger.info("-----------------------------")
+        summary_lines.append(summary_message)
+    summary_lines.append("-----------------------------")
+    logger.info("\n".join(summary_lines))
 
-    successful_filings = sum(1 for r in filing_reports if all(s != 'Missing' and 'Failed' not in s for s in r['statements'].values()))
     accuracy = (successful_filings / len(downloaded_files_info)) * 100 if downloaded_files_info else 0
     logger.info(f"Overall Accuracy: {successful_filings}/{len(downloaded_files_info)} filings ({accuracy:.2f}%) successfully scraped.")
 
     # --- NEW: Cost and Token Reporting ---
     report_token_usage_and_cost(filing_reports)
 
-    if not all_data_points:
+    if not data_columns['value']:
         return None
 
-    df = pd.DataFrame(all_data_points)
-    df = df.rename(columns={'period_end_date': 'filing_period_end_date', 'units': 'unit'})
+    # Build the frame directly in output order, naming columns from their data point fields
     final_cols = ['symbol', 'form_type', 'date_filed', 'filing_period_end_date', 'fiscal_period', 'table_description', 'table_number', 'href', 'category', 'metric', 'value', 'unit']
-    df = df.reindex(columns=[col for col in final_cols if col in df.columns])
+    source_fields = {'filing_period_end_date': 'period_end_date', 'unit': 'units'}
+    df = pd.DataFrame({col: data_columns[source_fields.get(col, col)] for col in final_cols})
 
     logger.info(f"Total data points extracted: {len(df)}")
     return df
@@ -177,36 +234,43 @@ def main():
     form_groups = ['Quarterly Reports']
     filing_urls_to_scrape = [] 
 
-    with multiprocessing.Manager() as manager:
-        log_queue = manager.Queue(-1)
-        
-        listener = multiprocessing.Process(target=listener_process, args=(log_queue, listener_configurer))
-        listener.start()
+    if WORKER_START_METHOD is not None:
+        multiprocessing.set_start_method(WORKER_START_METHOD, force=True)
 
-        h = logging.handlers.QueueHandler(log_queue)
-        root = logging.getLogger()
-        root.addHandler(h)
-        root.setLevel(logging.INFO)
-        
-        final_df = scrape_sec_filings(
-            symbol=symbol, 
-            start_year=start_year, 
-            end_year=end_year, 
-            form_groups=form_groups,
-            filing_urls=filing_urls_to_scrape,
-            save_dir=f"sec_filings_{symbol.upper()}",
-            log_queue=log_queue
-        )
-
-        if final_df is not None and not final_df.empty:
-            output_filename = f"{symbol.upper()}_financial_data_parallel.csv"
-            final_df.to_csv(output_filename, index=False, encoding='utf-8')
-            root.info(f"Successfully exported data to {output_filename}")
+    # Workers receive the queue when the pool starts, so a plain queue avoids the Manager proxy hop
+    log_queue = multiprocessing.Queue(-1)
+    
+    listener = multiprocessing.Process(target=listener_process, args=(log_queue, listener_configurer))
+    listener.start()
+
+    h = logging.handlers.QueueHandler(log_queue)
+    root = logging.getLogger()
+    root.addHandler(h)
+    root.setLevel(logging.INFO)
+    
+    final_df = scrape_sec_filings(
+        symbol=symbol, 
+        start_year=start_year, 
+        end_year=end_year, 
+        form_groups=form_groups,
+        filing_urls=filing_urls_to_scrape,
+        save_dir=f"sec_filings_{symbol.upper()}",
+        log_queue=log_queue
+    )
+
+    if final_df is not None and not final_df.empty:
+        output_filename = f"{symbol.upper()}_financial_data_parallel.csv"
+        if pa is not None:
+            # PyArrow formats the CSV in C, which is much faster than to_csv for large frames
+            pacsv.write_csv(pa.Table.from_pandas(final_df, preserve_index=False), output_filename)
         else:
-            root.warning("No data was scraped, CSV file not created.")
-            
-        log_queue.put_nowait(None)
-        listener.join()
+            final_df.to_csv(output_filename, index=False, encoding='utf-8')
+        root.info(f"Successfully exported data to {output_filename}")
+    else:
+        root.warning("No data was scraped, CSV file not created.")
+        
+    log_queue.put_nowait(None)
+    listener.join()
 
 if __name__ == '__main__':
     main()
\ No newline at end of file
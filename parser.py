@@ -1,79 +1,168 @@
 # parser.py
 
+import hashlib
+import json
 import logging
 import logging.handlers
 import re
 import os
-from datetime import datetime
+import pickle
+import threading
+from multiprocessing import shared_memory
+from datetime import date
+from typing import NamedTuple
+import diskcache
 from bs4 import BeautifulSoup, Tag
+
+try:
+    import ahocorasick
+except ImportError:
+    ahocorasick = None
+
+# lxml builds the tree in C and is much faster on multi-MB filings; the stdlib parser is the fallback
+try:
+    import lxml  # noqa: F401
+    HTML_PARSER = 'lxml'
+except ImportError:
+    HTML_PARSER = 'html.parser'
 # Import the TokenCounter and the updated LLM functions
-from llm_analyzer import TokenCounter, classify_toc_items, validate_financial_toc, classify_table_by_surrounding_text
+import llm_analyzer
+from llm_analyzer import TokenCounter, LLM_SNIPPET_BATCH_SIZE, classify_toc_items, classify_text_snippets, match_statement_by_keyword
 
 # ==============================================================================
 # SECTION 1: CORE PARSING UTILITIES
 # ==============================================================================
 
+# Fields of every extracted data point; workers return them column-wise in this order
+DATA_POINT_FIELDS = ['symbol', 'form_type', 'date_filed', 'period_end_date', 'table_description', 'metric', 'value', 'units', 'fiscal_period', 'category', 'table_number', 'href']
+
+# Fields that vary within a table; every other field is shared by all of a table's data points
+ROW_FIELDS = ('metric', 'value', 'fiscal_period', 'category')
+TABLE_FIELDS = [field for field in DATA_POINT_FIELDS if field not in ROW_FIELDS]
+
+class DataPointBuffer:
+    """
+    Collects a filing's data points column-wise in `columns`, one list per field in DATA_POINT_FIELDS.
+    Table-wide fields are repeated once per table instead of being copied into a dict per data point.
+    """
+    def __init__(self):
+        self.columns = {field: [] for field in DATA_POINT_FIELDS}
+
+    def __len__(self):
+        return len(self.columns['metric'])
+
+    def add_table(self, table_context, metrics, values, fiscal_periods, categories):
+        """Appends one table's data points, given its shared context and its per-point columns."""
+        count = len(metrics)
+        for field in TABLE_FIELDS:
+            self.columns[field].extend([table_context[field]] * count)
+        self.columns['metric'].extend(metrics)
+        self.columns['value'].extend(values)
+        self.columns['fiscal_period'].extend(fiscal_periods)
+        self.columns['category'].extend(categories)
+
+# Currency symbols, thousands separators and spaces dropped from value strings before the sign is read
+VALUE_DELETIONS = str.maketrans('', '', '$, \xa0')
+# Parenthesized negatives keep only their digits and decimal point
+NEGATIVE_VALUE_CLEANUP_PATTERN = re.compile(r'[^\d.]')
+
+# Patterns used for every table and row, compiled once at import
+UNIT_PATTERN = re.compile(r'\((?:in\s+)?(?:millions|thousands|billions)[^)]*\)', re.IGNORECASE)
+# Matches a bare year or a full date like "Dec. 31, 2024", capturing only the year
+HEADER_YEAR_PATTERN = re.compile(r'\b(?:(?:Jan|Feb|Mar|Apr|May|Jun|Jul|Aug|Sep|Oct|Nov|Dec)[a-z]*\.?\s+\d{1,2},\s+)?(20\d{2})\b', re.IGNORECASE)
+VALUE_PATTERN = re.compile(r'(\([\d,.-]+\)|—|[\d,.-]+)')
+TOC_HEADER_PATTERN = re.compile(r'^\s*(TABLE\s+OF\s+CONTENTS|INDEX\s+TO\s+FINANCIAL\s+STATEMENTS)\s*$', re.IGNORECASE)
+TOC_HEADER_MAX_CHARS = len("INDEXTOFINANCIALSTATEMENTS")
+TOC_ITEM_PATTERN = re.compile(r'(ITEM\s+\d+[A-Z]?\.?)', re.IGNORECASE)
+TOC_ITEM_PREFIX_PATTERN = re.compile(r'^\s*ITEM\s+\d+[A-Z]?\.?\s*', re.IGNORECASE)
+TOC_PAGE_NUMBER_PATTERN = re.compile(r'[\s.]+\d+\s*$')
+# href values of links to anchors within the filing
+INTERNAL_LINK_PATTERN = re.compile(r'^#')
+WHITESPACE_PATTERN = re.compile(r'\s+')
+FISCAL_PERIOD_PATTERN = re.compile(r'for\s+the\s+(?:fiscal\s+year|quarterly\s+period)\s+ended', re.IGNORECASE)
+PERIOD_DATE_PATTERN = re.compile(r'([a-zA-Z]+\s+\d{1,2}\s*,\s*\d{4})')
+# Splits a matched period date into month name, day and year, accepting what strptime's "%B %d, %Y" accepts
+PERIOD_DATE_PARTS_PATTERN = re.compile(r'([a-zA-Z]+)\s+(\d{1,2})\s*,\s+(\d{4})')
+MONTH_NUMBERS = {name: number for number, name in enumerate(
+    ['january', 'february', 'march', 'april', 'may', 'june', 'july', 'august', 'september', 'october', 'november', 'december'], 1)}
+# The same phrase in raw filing bytes. Separators cover every character str's \s matches, as latin-1 or
+# UTF-8 bytes, plus space entities, numeric character references, comments and tags. The alternatives never
+# match the same text, as a comment ends at its first "-->" and the tag branch skips comments, so a long run
+# of separators cannot make the search backtrack exponentially.
+_RAW_WORD_SEPARATOR = (
+    rb'(?:\s|[\x1c-\x1f\x85\xa0]|\xc2[\x85\xa0]|\xe1\x9a\x80|\xe2\x80[\x80-\x8a\xa8\xa9\xaf]|\xe2\x81\x9f|\xe3\x80\x80'
+    rb'|&(?:nbsp|ensp|emsp|thinsp|emsp13|emsp14|numsp|puncsp|hairsp|MediumSpace|NewLine|Tab);|&#x?[0-9a-fA-F]+;'
+    rb'|<!--(?:[^-]|-(?!->))*-->|<(?!!--)[^>]*>)+'
+)
+RAW_FISCAL_PERIOD_PATTERN = re.compile(
+    _RAW_WORD_SEPARATOR.join([rb'for', rb'the', rb'(?:fiscal' + _RAW_WORD_SEPARATOR + rb'year|quarterly' + _RAW_WORD_SEPARATOR + rb'period)', rb'ended']),
+    re.IGNORECASE,
+)
+
 def parse_financial_value(value_str):
     """
     Parses a string to extract a financial value, handling commas, parentheses for negatives, and dashes.
     """
     if not value_str:
         return None
-    cleaned_str = value_str.strip().replace('$', '').replace(',', '')
-    if cleaned_str in ['—', '-']:
+    cleaned_str = value_str.strip().translate(VALUE_DELETIONS)
+    if cleaned_str in ('—', '-'):
         return 0.0
     if not cleaned_str:
         return None
-    is_negative = cleaned_str.startswith('(') and cleaned_str.endswith(')')
-    if is_negative:
-        cleaned_str = '-' + re.sub(r'[^\d.]', '', cleaned_str)
+    if cleaned_str[0] == '(' and cleaned_str[-1] == ')':
+        cleaned_str = '-' + NEGATIVE_VALUE_CLEANUP_PATTERN.sub('', cleaned_str)
     try:
         return float(cleaned_str)
-    except (ValueError, TypeError):
+    except ValueError:
         return None
 
-def find_table_units(table):
+# Per-thread memo of tag texts for the filing being processed, set up by `process_single_filing`
+_TAG_TEXT_CACHE = threading.local()
+
+def get_tag_text(tag):
+    """Returns `tag.get_text(" ", strip=True)`, extracting it only once per tag within a filing."""
+    texts = getattr(_TAG_TEXT_CACHE, 'texts', None)
+    if texts is None:
+        return tag.get_text(" ", strip=True)
+    text = texts.get(id(tag))
+    if text is None:
+        text = texts[id(tag)] = tag.get_text(" ", strip=True)
+    return text
+
+def find_table_units(table, rows):
     """
     Searches for financial units (e.g., 'in millions') associated with a table by checking
     nearby text and the table's initial rows.
     """
-    unit_pattern = re.compile(r'\((?:in\s+)?(?:millions|thousands|billions)[^)]*\)', re.IGNORECASE)
     # Check the first few rows of the table
-    for row in table.find_all('tr', limit=5):
-        match = unit_pattern.search(row.get_text(" ", strip=True))
+    for row in rows[:5]:
+        match = UNIT_PATTERN.search(get_tag_text(row))
         if match:
             return match.group(0)
     # Check the tags immediately preceding the table
     for prev_tag in table.find_previous_siblings(limit=15):
         if prev_tag.name in ['p', 'div', 'span', 'b', 'strong']:
-            match = unit_pattern.search(prev_tag.get_text(" ", strip=True))
+            match = UNIT_PATTERN.search(get_tag_text(prev_tag))
             if match:
                 return match.group(0)
     return None
 
-def parse_table_headers(table):
+def parse_table_headers(rows):
     """
-    Finds the header row in a table and returns a list of all fiscal years found.
+    Finds the header row among a table's rows and returns a list of all fiscal years found.
     This is critical for correctly mapping values to their respective periods.
     """
     logger = logging.getLogger()
-    header_rows = table.find_all('tr', limit=10)
-    date_pattern = re.compile(r'\b((?:Jan|Feb|Mar|Apr|May|Jun|Jul|Aug|Sep|Oct|Nov|Dec)[a-z]*\.?\s+\d{1,2},\s+20\d{2})\b|\b(20\d{2})\b', re.IGNORECASE)
+    header_rows = rows[:10]
+    find_years = HEADER_YEAR_PATTERN.findall
     
     for row in header_rows:
-        header_text = row.get_text(" ", strip=True)
-        matches = date_pattern.findall(header_text)
-        
-        years_found = []
-        for full_date, year_only in matches:
-            if full_date:
-                try:
-                    # Extract just the year from a full date string like "Dec. 31, 2024"
-                    years_found.append(re.search(r'(20\d{2})', full_date).group(1))
-                except (AttributeError, IndexError):
-                    continue
-            elif year_only:
-                years_found.append(year_only)
+        header_text = get_tag_text(row)
+        # Every year the pattern accepts starts with "20", so most non-header rows skip the regex
+        if '20' not in header_text:
+            continue
+        years_found = find_years(header_text)
 
         if years_found:
             # logger.info(f"Header parse found raw years: {years_found} in text: '{header_text[:150]}...'")
@@ -83,6 +172,24 @@ def parse_table_headers(table):
     return []
 
 
+def get_table_rows(table, table_info):
+    """Returns the table's rows, collecting them only on first use."""
+    if 'rows' not in table_info:
+        table_info['rows'] = table.find_all('tr')
+    return table_info['rows']
+
+def get_fiscal_periods(table, table_info):
+    """Returns the table's fiscal periods, parsing its headers only on first use."""
+    if 'fiscal_periods' not in table_info:
+        table_info['fiscal_periods'] = parse_table_headers(get_table_rows(table, table_info))
+    return table_info['fiscal_periods']
+
+def get_table_units(table, table_info):
+    """Returns the table's units, searching for them only on first use."""
+    if 'units' not in table_info:
+        table_info['units'] = find_table_units(table, get_table_rows(table, table_info)) or "N/A"
+    return table_info['units']
+
 def scrape_data_from_tables(tables, context, all_data_points, table_map, toc_href=None):
     """
     The core data extraction function. Iterates through rows of provided tables and extracts
@@ -90,20 +197,30 @@ def scrape_data_from_tables(tables, context, all_data_points, table_map, toc_hre
     """
     logger = logging.getLogger()
     for table in tables:
-        table_info = table_map.get(table)
+        table_info = table_map.get(id(table))
         if not table_info:
             continue
 
-        fiscal_periods = parse_table_headers(table)
+        fiscal_periods = get_fiscal_periods(table, table_info)
         num_periods = len(fiscal_periods)
         
         if num_periods == 0:
             logger.warning(f"Skipping table #{table_info.get('number', 'N/A')} because no fiscal periods were found.")
             continue
 
-        units = find_table_units(table) or "N/A"
+        rows = get_table_rows(table, table_info)
+        units = get_table_units(table, table_info)
+        # Fields shared by every data point in this table
+        table_context = {
+            **context,
+            "units": units,
+            "table_number": table_info['number'],
+            "href": toc_href if toc_href else f"#{table_info['id']}"
+        }
         current_category = ""
-        for row in table.find_all('tr'):
+        find_values = VALUE_PATTERN.findall
+        metrics, values, periods, categories = [], [], [], []
+        for row in rows:
             cells = row.find_all(['td', 'th'])
             if not cells:
                 continue
@@ -112,103 +229,141 @@ def scrape_data_from_tables(tables, context, all_data_points, table_map, toc_hre
             if not metric_name or metric_name.isdigit():
                 continue
 
-            full_row_text = " ".join([c.get_text(" ", strip=True) for c in cells[1:]])
-            value_strings = re.findall(r'(\([\d,.-]+\)|—|[\d,.-]+)', full_row_text)
+            # Values never span cells, so each cell is scanned on its own instead of joining the row
+            value_strings = []
+            for cell in cells[1:]:
+                value_strings.extend(find_values(cell.get_text(" ", strip=True)))
 
             if not value_strings:
                 current_category = metric_name
                 continue
             
             if len(value_strings) == num_periods:
-                for i, period in enumerate(fiscal_periods):
-                    if i < len(value_strings):
-                        value = parse_financial_value(value_strings[i])
-                        if value is not None:
-                            all_data_points.append({
-                                **context,
-                                "metric": metric_name,
-                                "value": value,
-                                "units": units,
-                                "fiscal_period": period,
-                                "category": current_category,
-                                "table_number": table_info['number'],
-                                "href": toc_href if toc_href else f"#{table_info['id']}"
-                            })
+                for period, value_string in zip(fiscal_periods, value_strings):
+                    value = parse_financial_value(value_string)
+                    if value is not None:
+                        metrics.append(metric_name)
+                        values.append(value)
+                        periods.append(period)
+                        categories.append(current_category)
             elif value_strings:
                  logger.warning(f"Skipping row '{metric_name[:50]}...'. Found {len(value_strings)} values but expected {num_periods}.")
 
+        all_data_points.add_table(table_context, metrics, values, periods, categories)
+
 
 # ==============================================================================
 # SECTION 2: TOC-GUIDED SCRAPING LOGIC (PRIMARY PATH)
 # ==============================================================================
 
-def find_all_toc_tables(soup):
+class TocItem(NamedTuple):
+    """One linked row of a Table of Contents and the tag its link points to."""
+    item_no: str
+    item_description: str
+    anchor_href: str
+    anchor_tag: Tag
+
+def is_toc_header(tag):
+    """
+    Checks whether a tag's whole text is a ToC heading. Text is read string by string and the check
+    stops once it holds more non-space characters than either heading, so wrapper elements around
+    large parts of the document are rejected without extracting all of their text.
+    """
+    parts = []
+    non_space_chars = 0
+    for string in tag.stripped_strings:
+        non_space_chars += len("".join(string.split()))
+        if non_space_chars > TOC_HEADER_MAX_CHARS:
+            return False
+        parts.append(string)
+    return TOC_HEADER_PATTERN.search("".join(parts)) is not None
+
+def find_all_toc_tables(soup, all_tables, table_map):
     """
     Finds all potential Table of Contents tables in the document using multiple heuristics.
+    Rows are collected through `table_map`, so tables scraped later reuse them.
     """
     toc_tables = []
-    potential_headers = soup.find_all(lambda tag: tag.name in ['p', 'div', 'b'] and re.search(r'^\s*(TABLE\s+OF\s+CONTENTS|INDEX\s+TO\s+FINANCIAL\s+STATEMENTS)\s*$', tag.get_text(strip=True), re.IGNORECASE))
+    toc_table_ids = set()
+    potential_headers = [tag for tag in soup.find_all(['p', 'div', 'b']) if is_toc_header(tag)]
     for header in potential_headers:
         parent = header.find_parent(('div', 'p')) or header
         if 'center' in parent.get('align', '') or 'text-align:center' in parent.get('style', ''):
             potential_table = parent.find_next('table')
-            if potential_table and len(potential_table.find_all('tr')) > 5:
-                if potential_table not in toc_tables:
+            if potential_table and id(potential_table) not in toc_table_ids:
+                if len(get_table_rows(potential_table, table_map[id(potential_table)])) > 5:
                     toc_tables.append(potential_table)
-    for table in soup.find_all('table'):
-        if table in toc_tables: continue
-        rows = table.find_all('tr')
+                    toc_table_ids.add(id(potential_table))
+    for table in all_tables:
+        if id(table) in toc_table_ids: continue
+        rows = get_table_rows(table, table_map[id(table)])
         if len(rows) < 10: continue
-        link_count = sum(1 for r in rows[:20] if r.find('a', href=lambda h: h and h.startswith('#')))
+        link_count = sum(1 for r in rows[:20] if r.find('a', href=INTERNAL_LINK_PATTERN))
         if link_count > 7:
             toc_tables.append(table)
     return toc_tables
 
-def parse_toc_table_to_index(toc_table, soup):
+def build_anchor_index(soup):
+    """
+    Maps every anchor name in the document to its target tag: the first <a name=...> with that
+    name, or else the first tag with that id, as the two `soup.find` lookups would resolve it.
+    """
+    anchors = {}
+    for tag in soup.find_all(id=True):
+        anchors.setdefault(tag['id'], tag)
+    named_links = {}
+    for link in soup.find_all('a', attrs={'name': True}):
+        named_links.setdefault(link['name'], link)
+    anchors.update(named_links)
+    return anchors
+
+def parse_toc_table_to_index(toc_table, anchors):
     """
     Parses a single BeautifulSoup table object into a structured list of items.
+    `anchors` maps anchor names to their tags, as built by `build_anchor_index`.
     """
     index = []
     for row in toc_table.find_all('tr'):
-        links = row.find_all('a', href=lambda href: href and href.startswith('#'))
+        links = row.find_all('a', href=INTERNAL_LINK_PATTERN)
         if not links: continue
         main_href = links[-1]['href']
         anchor_name = main_href.lstrip('#')
-        anchor_tag = soup.find('a', {'name': anchor_name}) or soup.find(id=anchor_name)
+        anchor_tag = anchors.get(anchor_name)
         text = row.get_text(" ", strip=True).replace('\xa0', ' ')
-        item_match = re.search(r'(ITEM\s+\d+[A-Z]?\.?)', text, re.IGNORECASE)
-        desc = re.sub(r'^\s*ITEM\s+\d+[A-Z]?\.?\s*', '', text, flags=re.IGNORECASE).strip()
-        desc = re.sub(r'[\s.]+\d+\s*$', '', desc).strip()
+        item_match = TOC_ITEM_PATTERN.search(text)
+        desc = TOC_ITEM_PREFIX_PATTERN.sub('', text).strip()
+        desc = TOC_PAGE_NUMBER_PATTERN.sub('', desc).strip()
         if desc and anchor_tag:
-            index.append({'item_no': item_match.group(1).upper().strip() if item_match else "N/A", 'item_description': desc, 'anchor_href': main_href, 'anchor_tag': anchor_tag})
+            index.append(TocItem(item_match.group(1).upper().strip() if item_match else "N/A", desc, main_href, anchor_tag))
     return index
 
 def get_section_content_between_anchors(start_tag, end_tag):
     """
     "Slices" the HTML document by collecting all sibling tags between a start and end anchor.
+    The tags are returned from the original tree, so tables found in them can be looked up in `table_map`.
     """
-    content_tags = []
-    current_tag = start_tag
-    while current_tag:
-        if current_tag == end_tag: break
-        content_tags.append(current_tag)
-        current_tag = current_tag.find_next_sibling()
-    if not content_tags:
-        return BeautifulSoup("", 'html.parser')
-    return BeautifulSoup("".join(str(t) for t in content_tags), 'html.parser')
+    if start_tag is end_tag:
+        return []
+    content_tags = [start_tag]
+    current = start_tag.next_sibling
+    while current is not None and current is not end_tag:
+        if isinstance(current, Tag):
+            content_tags.append(current)
+        current = current.next_sibling
+    return content_tags
 
 def get_text_between_elements(start_element, end_element):
     """
     Extracts and cleans all the text between a start and end HTML element.
     """
     text_parts = []
-    current_element = start_element.find_next_sibling()
-    while current_element and current_element != end_element:
+    current_element = start_element.next_sibling
+    while current_element is not None and current_element is not end_element:
         if isinstance(current_element, Tag) and current_element.name != 'table':
-            text_parts.append(current_element.get_text(" ", strip=True))
-        current_element = current_element.find_next_sibling()
+            text_parts.append(get_tag_text(current_element))
+        current_element = current_element.next_sibling
     full_text = " ".join(text_parts).strip()
-    return re.sub(r'\s+', ' ', full_text)
+    return WHITESPACE_PATTERN.sub(' ', full_text)
 
 def process_guided_scrape(full_index, soup, base_context, terms_dict, all_data_points, status_report, table_map, token_counter):
     """
@@ -218,48 +373,136 @@ def process_guided_scrape(full_index, soup, base_context, terms_dict, all_data_p
     if not mapped_statements:
         return False
     statements_found_in_this_run = 0
-    tag_to_index_pos = {item['anchor_tag']: i for i, item in enumerate(full_index)}
+    # Keyed by id(): anchors can be whole sections, which Tag hashing would serialize
+    tag_to_index_pos = {id(item.anchor_tag): i for i, item in enumerate(full_index)}
     needed_statements = set(mapped_statements.keys())
+
+    # Collect the header text of every table in the mapped sections so they can be classified in one LLM call
+    candidate_tables = []
+    # Statement types can map to the same or overlapping sections; each table is a candidate once
+    seen_table_ids = set()
     for toc_statement_type, toc_item in mapped_statements.items():
-        start_tag = toc_item['anchor_tag']
-        toc_anchor_href = toc_item['anchor_href']
-        current_pos = tag_to_index_pos.get(start_tag)
+        start_tag = toc_item.anchor_tag
+        toc_anchor_href = toc_item.anchor_href
+        current_pos = tag_to_index_pos.get(id(start_tag))
         end_tag = None
         if current_pos is not None and current_pos + 1 < len(full_index):
-            end_tag = full_index[current_pos + 1]['anchor_tag']
-        section_soup = get_section_content_between_anchors(start_tag, end_tag)
-        tables_in_section = section_soup.find_all('table')
+            end_tag = full_index[current_pos + 1].anchor_tag
+        tables_in_section = []
+        for section_tag in get_section_content_between_anchors(start_tag, end_tag):
+            if section_tag.name == 'table':
+                tables_in_section.append(section_tag)
+            tables_in_section.extend(section_tag.find_all('table'))
         if not tables_in_section: continue
         last_element = start_tag
         for table in tables_in_section:
-            header_text = get_text_between_elements(last_element, table)
-            if not header_text:
-                last_element = table
-                continue
-            classified_type = classify_table_by_surrounding_text(header_text, list(terms_dict.keys()), token_counter)
-            if classified_type and classified_type in needed_statements:
-                context = {**base_context, "table_description": classified_type.replace('_', ' ').title()}
-                initial_data_point_count = len(all_data_points)
-                scrape_data_from_tables([table], context, all_data_points, table_map, toc_href=toc_anchor_href)
-                if len(all_data_points) > initial_data_point_count:
-                    status_report['statements'][classified_type] = 'Found (ToC-Guided & Verified)'
-                    statements_found_in_this_run += 1
-                    needed_statements.remove(classified_type)
+            if id(table) not in seen_table_ids:
+                seen_table_ids.add(id(table))
+                header_text = get_text_between_elements(last_element, table)
+                if header_text:
+                    candidate_tables.append((table, header_text, toc_anchor_href))
             last_element = table
+    if not candidate_tables:
+        return False
+
+    classified_types = classify_text_snippets([header_text for _, header_text, _ in candidate_tables], list(terms_dict.keys()), token_counter)
+    for (table, _, toc_anchor_href), classified_type in zip(candidate_tables, classified_types):
+        if classified_type and classified_type in needed_statements:
+            context = {**base_context, "table_description": classified_type.replace('_', ' ').title()}
+            initial_data_point_count = len(all_data_points)
+            scrape_data_from_tables([table], context, all_data_points, table_map, toc_href=toc_anchor_href)
+            if len(all_data_points) > initial_data_point_count:
+                status_report['statements'][classified_type] = 'Found (ToC-Guided & Verified)'
+                statements_found_in_this_run += 1
+                needed_statements.remove(classified_type)
     return statements_found_in_this_run > 0
 
 # ==============================================================================
 # SECTION 3: FALLBACK SCRAPING LOGIC
 # ==============================================================================
 
-def find_and_scrape_financial_statements_fallback(soup, base_context, terms_dict, all_data_points, status_report, table_map, token_counter):
+def get_all_terms(data):
+    """Flattens a nested dict of term lists into a single list of terms."""
+    if isinstance(data, list): return data
+    terms = []
+    if isinstance(data, dict):
+        for v in data.values(): terms.extend(get_all_terms(v))
+    return terms
+
+def build_term_automaton(flat_terms):
+    """
+    Builds an Aho-Corasick automaton over all scoring terms, mapping each term to the statement
+    types that list it. Returns None when pyahocorasick is not installed.
+    """
+    if ahocorasick is None:
+        return None
+    automaton = ahocorasick.Automaton()
+    for s_type, terms in flat_terms.items():
+        for term in terms:
+            if term in automaton:
+                automaton.get(term)[1].append(s_type)
+            else:
+                automaton.add_word(term, (term, [s_type]))
+    automaton.make_automaton()
+    return automaton
+
+# The terms dict the cached index was built from, its flattened per-statement terms, and their automaton
+_TERM_INDEX = (None, None, None)
+
+def get_term_index(terms_dict):
+    """
+    Returns each statement type's flattened terms and the automaton over them, building both once
+    per process instead of once per filing.
+    """
+    global _TERM_INDEX
+    cached_terms, flat_terms, automaton = _TERM_INDEX
+    if cached_terms is not terms_dict:
+        flat_terms = {s: get_all_terms(c) for s, c in terms_dict.items()}
+        automaton = build_term_automaton(flat_terms)
+        _TERM_INDEX = (terms_dict, flat_terms, automaton)
+    return flat_terms, automaton
+
+def score_text_with_automaton(text, automaton, flat_terms):
+    """
+    Counts, per statement type in `flat_terms`, how many of its terms occur in the text, in a
+    single scan. Matches for statement types outside `flat_terms` are ignored.
+    """
+    scores = dict.fromkeys(flat_terms, 0)
+    matched_terms = set()
+    for _, (term, s_types) in automaton.iter(text):
+        if term in matched_terms: continue
+        matched_terms.add(term)
+        for s_type in s_types:
+            if s_type in scores:
+                scores[s_type] += 1
+    return scores
+
+def get_leading_text(table, length):
+    """
+    Returns the first `length` characters of the table's text as `get_text(" ", strip=True)` would
+    produce them, without extracting the rest of the table.
+    """
+    parts = []
+    collected = -1  # No separator before the first string
+    for string in table.stripped_strings:
+        parts.append(string)
+        collected += len(string) + 1
+        if collected >= length: break
+    return " ".join(parts)[:length]
+
+# A table must match more than this many of a statement's terms to be scraped as that statement
+FALLBACK_MIN_SCORE = 10
+# Tables with fewer rows are never scored as statements
+FALLBACK_MIN_ROWS = 5
+
+def find_and_scrape_financial_statements_fallback(soup, all_tables, base_context, terms_dict, all_data_points, status_report, table_map, token_counter):
     """
     A multi-stage fallback method with the fix implemented.
+    Returns whether keyword scoring ran, i.e. whether the outcome depends on the terms' contents.
     """
     logger = logging.getLogger()
     logger.warning("Executing Fallback scraping path...")
     
-    all_tables = soup.find_all('table')
     needed_statements = set(terms_dict.keys())
     found_tables_by_type = {}
     processed_tables = set()
@@ -267,72 +510,91 @@ def find_and_scrape_financial_statements_fallback(soup, base_context, terms_dict
     # --- STAGE 1: LLM Header Classification ---
     logger.info("Fallback Stage 1: Attempting LLM header classification.")
     
+    # Headers are classified in one LLM call per window of tables, so the scan still stops
+    # shortly after the last needed statement is found
     last_element = soup.find('body')
-    for table in all_tables:
+    for window_start in range(0, len(all_tables), LLM_SNIPPET_BATCH_SIZE):
         if not needed_statements: break
-        header_text = get_text_between_elements(last_element, table)
-        if header_text:
-            classified_type = classify_table_by_surrounding_text(header_text, list(needed_statements), token_counter)
-            if classified_type:
-                logger.info(f"LLM Fallback identified a potential '{classified_type}' for table #{table_map.get(table, {}).get('number')}.")
-                if not parse_table_headers(table):
+        window_tables = all_tables[window_start:window_start + LLM_SNIPPET_BATCH_SIZE]
+        header_texts = []
+        for table in window_tables:
+            header_texts.append(get_text_between_elements(last_element, table))
+            last_element = table
+        snippets = [header_text for header_text in header_texts if header_text]
+        window_statement_types = list(needed_statements)
+        classified_types = iter(classify_text_snippets(snippets, window_statement_types, token_counter))
+
+        for table, header_text in zip(window_tables, header_texts):
+            if not needed_statements: break
+            if not header_text: continue
+            classified_type = next(classified_types)
+            if classified_type and classified_type in needed_statements:
+                table_info = table_map.get(id(table), {})
+                # Headings classified locally by a statement title are reported apart from LLM answers
+                by_keyword = match_statement_by_keyword(header_text, window_statement_types) == classified_type
+                source = 'Keyword' if by_keyword else 'LLM'
+                logger.info(f"{source} Fallback identified a potential '{classified_type}' for table #{table_info.get('number')}.")
+                if not get_fiscal_periods(table, table_info):
                     logger.warning(f"Table identified as '{classified_type}' but headers are not parsable. Skipping.")
                     status_report['statements'][classified_type] = 'Identified but Failed'
                     needed_statements.remove(classified_type)
-                    processed_tables.add(table)
-                    last_element = table
+                    processed_tables.add(id(table))
                     continue
                 context = {**base_context, "table_description": classified_type.replace('_', ' ').title()}
                 initial_data_count = len(all_data_points)
                 scrape_data_from_tables([table], context, all_data_points, table_map)
                 if len(all_data_points) > initial_data_count:
-                    status_report['statements'][classified_type] = 'Found (Fallback - LLM)'
+                    status_report['statements'][classified_type] = f'Found (Fallback - {source})'
                     needed_statements.remove(classified_type)
                     found_tables_by_type[classified_type] = table
-                    processed_tables.add(table)
-        last_element = table
+                    processed_tables.add(id(table))
 
-    if not needed_statements: return
+    if not needed_statements: return False
 
     # --- STAGE 2: Keyword Scoring (for remaining statements) ---
     logger.info(f"Fallback Stage 2: Attempting keyword scoring for remaining: {list(needed_statements)}")
     
-    def get_all_terms(data):
-        if isinstance(data, list): return data
-        terms = []
-        if isinstance(data, dict):
-            for v in data.values(): terms.extend(get_all_terms(v))
-        return terms
-
-    remaining_terms = {s_type: terms_dict[s_type] for s_type in needed_statements}
-    flat_terms = {s: get_all_terms(c) for s, c in remaining_terms.items()}
+    all_flat_terms, term_automaton = get_term_index(terms_dict)
+    flat_terms = {s_type: all_flat_terms[s_type] for s_type in needed_statements}
     
     scored_tables = []
-    tables_to_score = [t for t in all_tables if t not in processed_tables]
+    tables_to_score = [t for t in all_tables if id(t) not in processed_tables]
 
     for table in tables_to_score:
-        table_info = table_map.get(table, {"number": "N/A"})
+        table_info = table_map.get(id(table), {"number": "N/A"})
+        # Layout, page-number and signature tables are rejected from their cached row count
+        if len(get_table_rows(table, table_info)) < FALLBACK_MIN_ROWS: continue
+        # Percentage tables are rejected from their leading text before extracting the rest
+        if '%' in get_leading_text(table, 500): continue
         scores = {}
-        text = table.get_text(" ", strip=True).lower()
-        if '%' in text[:500]: continue
-        for s_type, terms in flat_terms.items():
-            scores[s_type] = sum(1 for term in terms if term in text)
-        if any(s > 5 for s in scores.values()):
+        text = get_tag_text(table).lower()
+        if term_automaton is not None:
+            scores = score_text_with_automaton(text, term_automaton, flat_terms)
+        else:
+            for s_type, terms in flat_terms.items():
+                scores[s_type] = sum(1 for term in terms if term in text)
+        # Only tables that could win a statement below are kept as candidates
+        if any(s > FALLBACK_MIN_SCORE for s in scores.values()):
             scored_tables.append({'table_obj': table, 'scores': scores, 'number': table_info['number']})
 
+    if not scored_tables: return True
+
     for s_type in list(needed_statements):
+        # Compared by id(): Tag equality would compare each candidate's whole subtree
+        found_table_ids = {id(t) for t in found_tables_by_type.values()}
         best_candidate = max(
-            (c for c in scored_tables if c['table_obj'] not in found_tables_by_type.values()),
+            (c for c in scored_tables if id(c['table_obj']) not in found_table_ids),
             key=lambda x: x['scores'].get(s_type, 0),
             default=None
         )
-        if best_candidate and best_candidate['scores'].get(s_type, 0) > 10:
+        if best_candidate and best_candidate['scores'].get(s_type, 0) > FALLBACK_MIN_SCORE:
             table = best_candidate['table_obj']
             found_tables_by_type[s_type] = table
             context = {**base_context, "table_description": s_type.replace('_', ' ').title()}
             scrape_data_from_tables([table], context, all_data_points, table_map)
             status_report['statements'][s_type] = 'Found (Fallback - Score)'
             needed_statements.remove(s_type)
+    return True
 
 # ==============================================================================
 # SECTION 4: MAIN PROCESSING ROUTER
@@ -341,33 +603,117 @@ def find_and_scrape_financial_statements_fallback(soup, base_context, terms_dict
 def extract_fiscal_period(html_content):
     """
     Extracts the filing's period end date from the document's header text.
+    The text of the first 1000 <p>/<div> tags is searched in doubling prefixes, stopping once one holds
+    both the period phrase and a date; a prefix's first date is also the full text's first date.
     """
-    soup = BeautifulSoup(html_content, 'html.parser')
-    patterns = [r"for\s+the\s+fiscal\s+year\s+ended", r"for\s+the\s+quarterly\s+period\s+ended"]
-    date_pattern = re.compile(r'([a-zA-Z]+\s+\d{1,2}\s*,\s*\d{4})', re.IGNORECASE)
-    text_blob = ' '.join(tag.get_text(" ", strip=True) for tag in soup.find_all(['p', 'div'], limit=1000))
-    if re.search('|'.join(patterns), text_blob, re.IGNORECASE):
-        date_match = date_pattern.search(text_blob)
-        if date_match:
-            try:
-                date_str = re.sub(r'\s+,', ',', date_match.group(1))
-                return datetime.strptime(date_str, "%B %d, %Y").date(), soup
-            except ValueError:
-                pass
+    soup = BeautifulSoup(html_content, HTML_PARSER)
+    header_tags = soup.find_all(['p', 'div'], limit=1000)
+    texts = []
+    checkpoint = 1
+    for count, tag in enumerate(header_tags, 1):
+        texts.append(tag.get_text(" ", strip=True))
+        if count != checkpoint and count != len(header_tags):
+            continue
+        checkpoint *= 2
+        text_blob = ' '.join(texts)
+        if not FISCAL_PERIOD_PATTERN.search(text_blob):
+            continue
+        date_match = PERIOD_DATE_PATTERN.search(text_blob)
+        if not date_match:
+            continue
+        date_parts = PERIOD_DATE_PARTS_PATTERN.fullmatch(date_match.group(1))
+        month = MONTH_NUMBERS.get(date_parts.group(1).lower()) if date_parts else None
+        if month is None:
+            break
+        try:
+            return date(int(date_parts.group(3)), month, int(date_parts.group(2))), soup
+        except ValueError:
+            break
     return None, soup
 
+# Financial statement terms, loaded once per worker process by `init_worker`
+_TERMS_DICT = None
+
+class BatchingQueueHandler(logging.handlers.MemoryHandler):
+    """Buffers log records and sends each flushed batch to the listener queue as a single list."""
+    def __init__(self, queue, capacity=200):
+        super().__init__(capacity, flushLevel=logging.ERROR)
+        self.queue_handler = logging.handlers.QueueHandler(queue)
+
+    def flush(self):
+        with self.lock:
+            if self.buffer:
+                self.queue_handler.enqueue([self.queue_handler.prepare(record) for record in self.buffer])
+                self.buffer.clear()
+
 def worker_configurer(queue):
     """Configures logging for each parallel worker process."""
-    h = logging.handlers.QueueHandler(queue)
+    h = BatchingQueueHandler(queue)
     root = logging.getLogger()
+    # Forked workers inherit the parent's per-record QueueHandler, which would send every record twice
+    for inherited_handler in list(root.handlers):
+        root.removeHandler(inherited_handler)
     root.addHandler(h)
     root.setLevel(logging.INFO)
-    
-def process_single_filing(filing_info, terms_dict, queue):
+
+def load_terms(terms_dict):
+    """Sets the financial statement terms used by `process_filing_task` in this process."""
+    global _TERMS_DICT
+    _TERMS_DICT = terms_dict
+
+def init_worker(queue, terms_shm_name=None, terms_size=0):
     """
-    The main function for a single worker process.
+    Pool initializer: configures logging and, unless the terms were inherited through fork,
+    unpickles the financial statement terms from the shared memory block written by the parent.
     """
     worker_configurer(queue)
+    if terms_shm_name is None:
+        return
+    terms_shm = shared_memory.SharedMemory(name=terms_shm_name)
+    try:
+        load_terms(pickle.loads(terms_shm.buf[:terms_size]))
+    finally:
+        terms_shm.close()
+
+def process_filing_task(filing_info):
+    """Pool task entry point: processes one filing with the terms loaded by `init_worker`."""
+    try:
+        return process_single_filing(filing_info, _TERMS_DICT)
+    finally:
+        # Send this filing's buffered log records before the result reaches the parent
+        for handler in logging.getLogger().handlers:
+            handler.flush()
+
+# Each filing's results are cached on disk, so reruns over unchanged filings skip reading and parsing
+# them. Set PARSE_CACHE_ENABLED to False to always process filings again, and bump PARSE_CACHE_VERSION
+# whenever a change to this module alters what is extracted.
+PARSE_CACHE_ENABLED = True
+PARSE_CACHE_VERSION = 1
+PARSE_CACHE_DIR = '.parse_cache'
+_PARSE_CACHE = diskcache.Cache(PARSE_CACHE_DIR)
+
+def get_filing_cache_key(filepath, filing_meta, terms_dict):
+    """
+    Builds a filing's result cache key from the cache version, the file's path, size and modification
+    time, the metadata copied into its data points, the statement types and the LLM setup. The terms'
+    contents are left out, as only keyword scoring uses them; see `get_terms_digest`.
+    """
+    stat = os.stat(filepath)
+    key_parts = [
+        PARSE_CACHE_VERSION, os.path.abspath(filepath), stat.st_size, stat.st_mtime_ns,
+        filing_meta.get('symbol'), filing_meta.get('form_type'), filing_meta.get('date_filed'),
+        sorted(terms_dict), llm_analyzer.LLM_MODEL_NAME, llm_analyzer.GEMINI_CONFIGURED,
+    ]
+    return hashlib.sha256(json.dumps(key_parts).encode('utf-8')).hexdigest()
+
+def get_terms_digest(terms_dict):
+    """Hashes the terms' contents, stored with cached results that keyword scoring contributed to."""
+    return hashlib.sha256(json.dumps(terms_dict, sort_keys=True).encode('utf-8')).hexdigest()
+
+def process_single_filing(filing_info, terms_dict):
+    """
+    The main function for a single worker process. Logging is set up once per worker by `worker_configurer`.
+    """
     logger = logging.getLogger()
     
     filepath, filing_meta = filing_info
@@ -377,50 +723,83 @@ def process_single_filing(filing_info, terms_dict, queue):
     # Each worker process gets its own token counter
     token_counter = TokenCounter()
 
+    # Tag texts are memoized while this filing is processed, since fallback stages revisit them
+    _TAG_TEXT_CACHE.texts = {}
+    soup = None
+    cache_key = None
+    llm_configured = llm_analyzer.GEMINI_CONFIGURED
     try:
-        with open(filepath, 'r', encoding='utf-8') as f:
+        if PARSE_CACHE_ENABLED:
+            cache_key = get_filing_cache_key(filepath, filing_meta, terms_dict)
+            cached_result = _PARSE_CACHE.get(cache_key)
+            # Results that keyword scoring contributed to are only reused while the terms are unchanged
+            if cached_result is not None and cached_result[2] in (None, get_terms_digest(terms_dict)):
+                logger.info(f"Loaded cached results for {os.path.basename(filepath)}.")
+                columns, status_report, _ = cached_result
+                return columns, status_report, token_counter.get_counts()
+
+        def cache_result(columns, used_terms=False):
+            # Results are only stored if no LLM call failed and the LLM stayed as available as the key records,
+            # so a transient API error never becomes a permanent degraded result
+            if cache_key is not None and token_counter.failed_calls == 0 and llm_analyzer.GEMINI_CONFIGURED == llm_configured:
+                terms_digest = get_terms_digest(terms_dict) if used_terms else None
+                _PARSE_CACHE.set(cache_key, (columns, status_report, terms_digest))
+            return columns, status_report, token_counter.get_counts()
+
+        # Filings are stored as downloaded; BeautifulSoup detects the encoding from the raw bytes
+        with open(filepath, 'rb') as f:
             html_content = f.read()
 
+        # Filings without the period phrase anywhere are rejected before building a DOM for them
+        if not RAW_FISCAL_PERIOD_PATTERN.search(html_content):
+            return cache_result(DataPointBuffer().columns)
+
         period_end_date, soup = extract_fiscal_period(html_content)
         if not period_end_date:
-            return [], status_report, token_counter.get_counts()
+            return cache_result(DataPointBuffer().columns)
         
         all_tables = soup.find_all('table')
+        # Keyed by id(): Tag hashes serialize the whole table, and Tag equality is structural
         table_map = {}
         for i, table in enumerate(all_tables):
             table_id = f"table-{i+1}"
             table['id'] = table_id
-            table_map[table] = {"number": i + 1, "id": table_id}
+            table_map[id(table)] = {"number": i + 1, "id": table_id}
 
-        file_data_points = []
+        file_data_points = DataPointBuffer()
         base_context = {
             'symbol': filing_meta.get('symbol'), 'form_type': filing_meta.get('form_type'),
             'date_filed': filing_meta.get('date_filed'), 'period_end_date': period_end_date,
         }
         
         guided_scrape_successful = False
-        potential_toc_tables = find_all_toc_tables(soup)
+        potential_toc_tables = find_all_toc_tables(soup, all_tables, table_map)
 
         if potential_toc_tables:
-            required_statements = list(terms_dict.keys())
+            # ToC links are resolved through one pass over the document instead of two searches per row
+            anchors = build_anchor_index(soup)
             for i, toc_table in enumerate(potential_toc_tables):
-                filing_index = parse_toc_table_to_index(toc_table, soup)
+                filing_index = parse_toc_table_to_index(toc_table, anchors)
                 if not filing_index: continue
-                
-                toc_descriptions = [item['item_description'] for item in filing_index]
-                is_financial_toc = validate_financial_toc(toc_descriptions, required_statements, token_counter)
-
-                if is_financial_toc:
-                    if process_guided_scrape(filing_index, soup, base_context, terms_dict, file_data_points, status_report, table_map, token_counter):
-                        guided_scrape_successful = True
-                        break
+
+                # The ToC is validated as a complete financial index while its items are classified
+                if process_guided_scrape(filing_index, soup, base_context, terms_dict, file_data_points, status_report, table_map, token_counter):
+                    guided_scrape_successful = True
+                    break
         
+        used_terms = False
         if not guided_scrape_successful:
-            find_and_scrape_financial_statements_fallback(soup, base_context, terms_dict, file_data_points, status_report, table_map, token_counter)
+            used_terms = find_and_scrape_financial_statements_fallback(soup, all_tables, base_context, terms_dict, file_data_points, status_report, table_map, token_counter)
 
         logger.info(f"Finished {os.path.basename(filepath)}, found {len(file_data_points)} data points.")
-        return file_data_points, status_report, token_counter.get_counts()
+        return cache_result(file_data_points.columns, used_terms)
 
     except Exception as e:
         logger.error(f"An unexpected error occurred while processing {os.path.basename(filepath)}: {e}", exc_info=True)
-        return [], status_report, token_counter.get_counts()
\ No newline at end of file
+        return DataPointBuffer().columns, status_report, token_counter.get_counts()
+    finally:
+        _TAG_TEXT_CACHE.texts = None
+        # The tree's parent/sibling links are reference cycles; breaking them frees it right away
+        # instead of leaving it for the cyclic collector while the worker parses the next filing
+        if soup is not None:
+            soup.decompose()
\ No newline at end of file
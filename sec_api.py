@@ -2,35 +2,59 @@
 import logging
 import re
 import requests
+from concurrent.futures import ThreadPoolExecutor
+from requests.adapters import HTTPAdapter
+
+# Year/form-group listings requested at once; the session keeps one pooled connection per request
+MAX_CONCURRENT_REQUESTS = 8
+REF_PATTERN = re.compile(r'ref=(\d+)')
+
+def create_session():
+    """Creates a keep-alive session sized for MAX_CONCURRENT_REQUESTS parallel API calls."""
+    session = requests.Session()
+    session.headers.update({'User-Agent': 'Mozilla/5.0'})
+    adapter = HTTPAdapter(pool_connections=1, pool_maxsize=MAX_CONCURRENT_REQUESTS)
+    session.mount('https://', adapter)
+    return session
+
+def fetch_filings_page(session, symbol, year, form_group):
+    """
+    Fetches the filing metadata for one year and form group. Returns an empty list if the request fails.
+    """
+    filings_meta = []
+    try:
+        api_url = f"https://api.nasdaq.com/api/company/{symbol}/sec-filings"
+        params = {'limit': 100, 'formGroup': form_group, 'year': year}
+        response = session.get(api_url, params=params, timeout=20)
+        response.raise_for_status()
+        filings = response.json().get('data', {}).get('rows', [])
+        logging.info(f"Found {len(filings)} filings for '{form_group}' in {year}.")
+        for f in filings:
+            # Extract the ref from the URL for a more unique filename
+            ref_match = REF_PATTERN.search(f.get('view', {}).get('htmlLink', ''))
+            filings_meta.append({
+                'url': f.get('view', {}).get('htmlLink'),
+                'form_type': f.get('formType'),
+                'date_filed': f.get('filed', '').split('#')[0],
+                'symbol': symbol.upper(),
+                'ref': ref_match.group(1) if ref_match else 'no_ref'
+            })
+    except Exception as e:
+        logging.error(f"Error fetching from NASDAQ API for {year} {form_group}: {e}")
+    return filings_meta
 
 def fetch_filing_metadata(symbol, start_year, end_year, form_groups):
     """
     Fetches a list of filing metadata from the NASDAQ API for a given symbol and period.
+    The year/form-group listings are requested concurrently over one keep-alive session,
+    and the results keep the order of the year and form-group loops.
     """
     filings_meta_to_process = []
-    headers = {'User-Agent': 'Mozilla/5.0'}
     logging.info("Fetching filing list from NASDAQ API...")
 
-    for year in range(start_year, end_year - 1, -1):
-        for form_group in form_groups:
-            try:
-                api_url = f"https://api.nasdaq.com/api/company/{symbol}/sec-filings"
-                params = {'limit': 100, 'formGroup': form_group, 'year': year}
-                response = requests.get(api_url, headers=headers, params=params, timeout=20)
-                response.raise_for_status()
-                filings = response.json().get('data', {}).get('rows', [])
-                logging.info(f"Found {len(filings)} filings for '{form_group}' in {year}.")
-                for f in filings:
-                    # Extract the ref from the URL for a more unique filename
-                    ref_match = re.search(r'ref=(\d+)', f.get('view', {}).get('htmlLink', ''))
-                    filings_meta_to_process.append({
-                        'url': f.get('view', {}).get('htmlLink'),
-                        'form_type': f.get('formType'),
-                        'date_filed': f.get('filed', '').split('#')[0],
-                        'symbol': symbol.upper(),
-                        'ref': ref_match.group(1) if ref_match else 'no_ref'
-                    })
-            except Exception as e:
-                logging.error(f"Error fetching from NASDAQ API for {year} {form_group}: {e}")
-    
+    requests_to_make = [(year, form_group) for year in range(start_year, end_year - 1, -1) for form_group in form_groups]
+    with create_session() as session, ThreadPoolExecutor(max_workers=MAX_CONCURRENT_REQUESTS) as executor:
+        pages = executor.map(lambda request: fetch_filings_page(session, symbol, *request), requests_to_make)
+        for filings_meta in pages:
+            filings_meta_to_process.extend(filings_meta)
     return filings_meta_to_process
\ No newline at end of file
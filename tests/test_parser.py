@@ -0,0 +1,24 @@
+import os
+import sys
+import time
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from parser import RAW_FISCAL_PERIOD_PATTERN
+
+
+class RawFiscalPeriodPatternTest(unittest.TestCase):
+    def test_matches_across_separators(self):
+        self.assertTrue(RAW_FISCAL_PERIOD_PATTERN.search(b'For <!-- a > b --> the<b>fiscal</b>&nbsp;year\n ended'))
+        self.assertTrue(RAW_FISCAL_PERIOD_PATTERN.search(b'for <!-- x --->the quarterly <!---->period ended'))
+        self.assertFalse(RAW_FISCAL_PERIOD_PATTERN.search(b'for the fiscal quarter ended'))
+
+    def test_comment_runs_do_not_backtrack(self):
+        start = time.perf_counter()
+        self.assertIsNone(RAW_FISCAL_PERIOD_PATTERN.search(b'for ' + b'<!-- -->' * 20 + b'x'))
+        self.assertLess(time.perf_counter() - start, 0.1)
+
+
+if __name__ == '__main__':
+    unittest.main()